@@ -1,32 +1,45 @@
 import json
 import boto3
-import subprocess
 import os
 import logging
+import ocrmypdf
+import pikepdf
+from io import BytesIO
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 # Configure logger for detailed CloudWatch logs
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize S3 client outside the handler for reuse
-s3 = boto3.client('s3')
+# Initialize S3 client outside the handler for reuse, with keep-alive and retries
+s3 = boto3.client('s3', config=Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'standard', 'max_attempts': 3}
+))
 
-# Define paths to executables within the Docker container
-LAMBDA_PYTHON_PATH = "/usr/local/bin/python3"
-QPDF_PATH = "/usr/bin/qpdf"
+# Multipart transfers with parallel parts for multi-MB scanned PDFs
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+
+# One Tesseract worker per vCPU available to the function
+OCR_JOBS = os.cpu_count() or 2
 
 
 def lambda_handler(event, context):
     """
     Main Lambda handler for preprocessing PDF invoices.
-    1. Downloads a PDF from the 'raw/' S3 prefix.
-    2. Uses 'ocrmypdf' (via subprocess) to add a text layer.
-    3. Validates the processed PDF using 'qpdf'.
+    1. Reads a PDF from the 'raw/' S3 prefix into memory.
+    2. Uses 'ocrmypdf' (in-process API) to add a text layer.
+    3. Validates the processed PDF in-process with 'pikepdf'.
     4. Uploads the processed file to the 'processed/' S3 prefix.
+    The PDFs stay in memory buffers, so nothing is written to /tmp by this code.
     """
-    local_path = None
-    ocr_output_path = None
-
     try:
         # 1. Parse S3 event record
         record = event['Records'][0]
@@ -34,58 +47,67 @@ def lambda_handler(event, context):
         key = record['s3']['object']['key']
         filename = os.path.basename(key)
 
-        # Define temporary file paths in the Lambda's /tmp directory
-        local_path = f"/tmp/{filename}"
-        ocr_output_path = f"/tmp/ocr_{filename}"
+        # User metadata (e.g. the uploader's 'invoice-id') is carried over to the output
+        metadata = s3.head_object(Bucket=bucket, Key=key)['Metadata']
 
-        logger.info(f"📥 Downloading s3://{bucket}/{key} to {local_path}...")
-        s3.download_file(bucket, key, local_path)
+        logger.info(f"📥 Downloading s3://{bucket}/{key} into memory...")
+        input_pdf = BytesIO()
+        s3.download_fileobj(bucket, key, input_pdf, Config=TRANSFER_CONFIG)
+        input_pdf.seek(0)
         logger.info("✅ Download complete.")
 
         # 2. Run OCRmyPDF
         # This adds a text layer to scanned PDFs, making them machine-readable.
-        logger.info(f"⚙️ Running OCRmyPDF on {local_path}...")
-        command = [
-            LAMBDA_PYTHON_PATH,
-            "-m", "ocrmypdf",
-            "--skip-text",        # Skip pages that already have text
-            "--deskew",           # Correct skewed scans
-            "--language", "eng+ita+fra+deu", # Support multiple languages
-            local_path,
-            ocr_output_path
-        ]
-
-        result = subprocess.run(
-            command, capture_output=True, text=True, check=False
-        )
-
-        if result.returncode != 0:
-            logger.error(f"❌ OCRmyPDF execution failed. Return code: {result.returncode}")
-            logger.error(f"Stderr: {result.stderr}")
-            logger.error(f"Stdout: {result.stdout}")
-            raise RuntimeError(f"OCRmyPDF failed: {result.stderr}")
-
-        logger.info(f"✅ OCR successfully completed. Stdout:\n{result.stdout}")
+        logger.info(f"⚙️ Running OCRmyPDF on {filename}...")
+        output_pdf = BytesIO()
+        # ocrmypdf is imported at module level, so warm invocations reuse it.
+        try:
+            exit_code = ocrmypdf.ocr(
+                input_pdf,
+                output_pdf,
+                skip_text=True,              # Skip pages that already have text
+                deskew=True,                 # Correct skewed scans
+                language="eng+ita+fra+deu",  # Support multiple languages
+                jobs=OCR_JOBS,               # OCR pages in parallel
+                use_threads=True,            # Lambda has no /dev/shm for process pools
+                output_type="pdf",           # Skip the PDF/A conversion pass
+                optimize=0,                  # Skip image optimization
+            )
+        except ocrmypdf.exceptions.ExitCodeException as e:
+            logger.error(f"❌ OCRmyPDF execution failed. Exit code: {e.exit_code}")
+            logger.error(f"Error: {e}")
+            raise RuntimeError(f"OCRmyPDF failed: {e}") from e
+        # Some failures (e.g. an invalid output PDF) are returned, not raised
+        if exit_code != ocrmypdf.ExitCode.ok:
+            logger.error(f"❌ OCRmyPDF execution failed. Exit code: {exit_code}")
+            raise RuntimeError(f"OCRmyPDF failed with exit code {exit_code!r}")
+
+        logger.info("✅ OCR successfully completed.")
 
         # 3. Validate processed PDF
         # Ensures the output file is not corrupted before uploading.
-        logger.info(f"🔍 Validating OCR'd file {ocr_output_path} with qpdf...")
-        qpdf_result = subprocess.run(
-            [QPDF_PATH, "--check", ocr_output_path],
-            capture_output=True, text=True, check=False
-        )
-
-        if qpdf_result.returncode != 0:
-            logger.error(f"❌ PDF validation failed for {ocr_output_path}.")
-            logger.error(f"Stderr: {qpdf_result.stderr}")
-            raise RuntimeError(f"PDF validation with qpdf failed: {qpdf_result.stderr}")
-
-        logger.info("✅ qpdf validation passed.")
+        # pikepdf is already loaded by ocrmypdf, so no extra process is spawned.
+        logger.info(f"🔍 Validating OCR'd {filename} with pikepdf...")
+        try:
+            output_pdf.seek(0)
+            with pikepdf.open(output_pdf):
+                pass
+        except pikepdf.PdfError as e:
+            logger.error(f"❌ PDF validation failed for {filename}.")
+            logger.error(f"Error: {e}")
+            raise RuntimeError(f"PDF validation with pikepdf failed: {e}") from e
+
+        logger.info("✅ pikepdf validation passed.")
 
         # 4. Upload processed file
         output_key = f"processed/{filename}"
         logger.info(f"📤 Uploading processed file to s3://{bucket}/{output_key}...")
-        s3.upload_file(ocr_output_path, bucket, output_key)
+        output_pdf.seek(0)
+        s3.upload_fileobj(
+            output_pdf, bucket, output_key,
+            ExtraArgs={'Metadata': metadata, 'ContentType': 'application/pdf'},
+            Config=TRANSFER_CONFIG
+        )
         logger.info("✅ Upload complete. Preprocessing finished.")
 
         return {
@@ -96,12 +118,3 @@ def lambda_handler(event, context):
     except Exception as e:
         logger.error(f"❌ Unrecoverable error in Lambda handler: {e}", exc_info=True)
         raise e  # Re-raise exception to mark the Lambda execution as failed
-
-    finally:
-        # 5. Cleanup
-        # Always remove temporary files from /tmp
-        if local_path and os.path.exists(local_path):
-            os.remove(local_path)
-        if ocr_output_path and os.path.exists(ocr_output_path):
-            os.remove(ocr_output_path)
-        logger.info("🧹 Cleaned up temporary files.")
@@ -2,59 +2,82 @@ import json
 import os
 import boto3
 import logging
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure the logger for clear, structured logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize the SES client once outside the handler for performance
-ses = boto3.client('ses')
+ses = boto3.client('ses', config=Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'standard', 'max_attempts': 3}
+))
+
+# Thread pool reused across warm invocations to send emails in parallel
+EXECUTOR = ThreadPoolExecutor(max_workers=10)
+
+def send_alert_email(invoice_id, reason):
+    """Sends the failure notification for a single invoice via SES."""
+    email_body = f"Invoice validation failed for: {invoice_id}\n\nReason: {reason}"
+    logger.info("📧 Sending email for failed invoice %s...", invoice_id)
+
+    response = ses.send_email(
+        Source=os.environ['ALERT_EMAIL_FROM'],
+        Destination={'ToAddresses': [os.environ['ALERT_EMAIL_TO']]},
+        Message={
+            'Subject': {'Data': f'⚠️ Invoice Validation Failed: {invoice_id}'},
+            'Body': {'Text': {'Data': email_body}}
+        }
+    )
+    return response['MessageId']
 
 def lambda_handler(event, context):
     """
     This function processes records from a DynamoDB stream.
-    If a record has a 'FAIL' status, it sends a notification email via SES.
+    Records are pre-filtered to inserted 'FAIL' items by the trigger's
+    FilterCriteria; each one gets a notification email via SES.
+    Emails for a batch of records are sent concurrently.
     """
     logger.info("🔔 Alert Lambda triggered")
     logger.debug("Received event: %s", json.dumps(event))
 
+    # Collect the failed invoices first, then fan out the SES calls
+    futures = {}
+
     # Safely get the list of records from the event payload.
+    # The event source mapping's FilterCriteria only delivers INSERTs with
+    # status 'FAIL', so every record here needs an alert.
     records = event.get("Records", [])
     for record in records:
         try:
             logger.info("📦 Processing record with eventID: %s", record.get('eventID'))
 
-            # Ensure we only process new items inserted into the table
-            if record.get("eventName") == "INSERT":
-                # Use .get() for safe dictionary access
-                new_image = record.get('dynamodb', {}).get('NewImage')
-                if not new_image:
-                    logger.warning("Record has no 'NewImage' field. Skipping.")
-                    continue
-
-                status = new_image.get('status', {}).get('S')
-                logger.info("ℹ️ Invoice status: %s", status)
-
-                if status == 'FAIL':
-                    # Access fields, providing defaults if they are missing
-                    invoice_id = new_image.get('invoice_id', {}).get('S', 'Unknown ID')
-                    reason = new_image.get('reason', {}).get('S', 'No reason provided.')
-
-                    email_body = f"Invoice validation failed for: {invoice_id}\n\nReason: {reason}"
-                    logger.info("📧 Sending email for failed invoice %s...", invoice_id)
-
-                    # Send the email notification
-                    response = ses.send_email(
-                        Source=os.environ['ALERT_EMAIL_FROM'],
-                        Destination={'ToAddresses': [os.environ['ALERT_EMAIL_TO']]},
-                        Message={
-                            'Subject': {'Data': f'⚠️ Invoice Validation Failed: {invoice_id}'},
-                            'Body': {'Text': {'Data': email_body}}
-                        }
-                    )
-                    logger.info("✅ Email sent. SES Message ID: %s", response['MessageId'])
+            # Use .get() for safe dictionary access
+            new_image = record.get('dynamodb', {}).get('NewImage')
+            if not new_image:
+                logger.warning("Record has no 'NewImage' field. Skipping.")
+                continue
+
+            # Access fields, providing defaults if they are missing
+            invoice_id = new_image.get('invoice_id', {}).get('S', 'Unknown ID')
+            reason = new_image.get('reason', {}).get('S', 'No reason provided.')
+
+            future = EXECUTOR.submit(send_alert_email, invoice_id, reason)
+            futures[future] = invoice_id
         except Exception as e:
             logger.error("❌ Error processing a record: %s", e, exc_info=True)
             continue
 
+    # Per-item error handling: one failed email does not stop the others
+    for future in as_completed(futures):
+        invoice_id = futures[future]
+        try:
+            message_id = future.result()
+            logger.info("✅ Email sent for %s. SES Message ID: %s", invoice_id, message_id)
+        except Exception as e:
+            logger.error("❌ Error sending email for %s: %s", invoice_id, e, exc_info=True)
+
     return {'statusCode': 200, 'body': json.dumps('Alerts processed successfully.')}
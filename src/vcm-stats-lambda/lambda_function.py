@@ -0,0 +1,153 @@
+import os
+import boto3
+import logging
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import Counter
+
+# Configure the logger for clear, structured logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize the DynamoDB client once outside the handler for performance
+dynamodb = boto3.client('dynamodb', config=Config(
+    tcp_keepalive=True,
+    retries={'mode': 'standard', 'max_attempts': 3}
+))
+
+STATUS_TABLE_NAME = os.environ['STATUS_TABLE_NAME']
+STATS_TABLE_NAME = os.environ['STATS_TABLE_NAME']
+# Single counters item read by the dashboard
+STATS_KEY = {'stats_id': {'S': 'invoices'}}
+
+# Newest ts_ms included in the seed scan; fixed once the counters item exists
+CACHED_SEEDED_THROUGH = None
+
+def image_counts(image):
+    """Counter contribution of one stored result (empty for no image or a non-result item)."""
+    if not image or 'status' not in image:
+        return Counter()
+    country = image.get('country', {}).get('S', 'N/A')
+    return Counter({
+        'total': 1,
+        'pass_count': int(image['status'].get('S') == 'PASS'),
+        f'country_{country}': 1,
+    })
+
+def image_ts_ms(image):
+    """Write time of a stored result in epoch millis (0 if unknown)."""
+    return int(image.get('ts_ms', {}).get('N', 0)) if image else 0
+
+def batch_deltas(records, seeded_through):
+    """
+    Sums NewImage minus OldImage over the stream records. A retried or
+    re-uploaded invoice overwrites its own item, so it only moves the
+    counters when its status or country actually changed. Records whose
+    new state is no newer than the seed are already in the counts.
+    """
+    deltas = Counter()
+    for record in records:
+        images = record.get('dynamodb', {})
+        new_image = images.get('NewImage')
+        if new_image and image_ts_ms(new_image) <= seeded_through:
+            continue
+        deltas.update(image_counts(new_image))
+        deltas.subtract(image_counts(images.get('OldImage')))
+    return {name: n for name, n in deltas.items() if n}
+
+def add_to_stats(deltas):
+    """Applies the deltas to the counters item with one atomic ADD."""
+    names = {}
+    values = {}
+    adds = []
+    for i, (name, n) in enumerate(deltas.items()):
+        names[f'#a{i}'] = name
+        values[f':a{i}'] = {'N': str(n)}
+        adds.append(f'#a{i} :a{i}')
+    dynamodb.update_item(
+        TableName=STATS_TABLE_NAME,
+        Key=STATS_KEY,
+        UpdateExpression='ADD ' + ', '.join(adds),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+def scan_counts():
+    """
+    Counts every stored result with a consistent, projected scan.
+    Returns (counts, newest ts_ms seen).
+    """
+    scan_kwargs = {
+        'TableName': STATUS_TABLE_NAME,
+        'ConsistentRead': True,
+        'ProjectionExpression': '#s, country, ts_ms',
+        'ExpressionAttributeNames': {'#s': 'status'},
+    }
+    counts = Counter()
+    newest = 0
+    while True:
+        response = dynamodb.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            counts.update(image_counts(item))
+            newest = max(newest, image_ts_ms(item))
+        if 'LastEvaluatedKey' not in response:
+            return counts, newest
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def seed_stats():
+    """
+    Creates the counters item from a full scan, so invoices stored before the
+    counters existed are included, and records the newest ts_ms it counted.
+    Stream records up to that ts_ms are then skipped instead of added twice.
+    Bounded race: a result stamped before that ts_ms but written after the
+    scan (a Lambda still between validation and its DynamoDB write) is missed.
+    Returns False if another invocation seeded it first.
+    """
+    counts, newest = scan_counts()
+    item = {
+        **STATS_KEY,
+        'total': {'N': '0'},
+        'pass_count': {'N': '0'},
+        'seeded_through_ts_ms': {'N': str(newest)},
+    }
+    item.update({name: {'N': str(n)} for name, n in counts.items()})
+    try:
+        dynamodb.put_item(
+            TableName=STATS_TABLE_NAME,
+            Item=item,
+            ConditionExpression='attribute_not_exists(stats_id)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    logger.info("🌱 Seeded dashboard stats from %d stored invoices", counts['total'])
+    return True
+
+def get_seeded_through():
+    """Returns the seed's ts_ms cutoff, seeding the counters item on first use."""
+    global CACHED_SEEDED_THROUGH
+    if CACHED_SEEDED_THROUGH is None:
+        item = None
+        while not item:
+            item = dynamodb.get_item(
+                TableName=STATS_TABLE_NAME, Key=STATS_KEY, ConsistentRead=True,
+                ProjectionExpression='seeded_through_ts_ms'
+            ).get('Item')
+            # Missing: seed it (or lose the race to another seed) and read it back
+            if not item:
+                seed_stats()
+        CACHED_SEEDED_THROUGH = int(item['seeded_through_ts_ms']['N'])
+    return CACHED_SEEDED_THROUGH
+
+def lambda_handler(event, context):
+    """
+    Keeps the dashboard counters item in step with the status table stream.
+    Errors are raised so Lambda retries the batch; the single ADD either
+    applies the whole batch or nothing.
+    """
+    deltas = batch_deltas(event.get('Records', []), get_seeded_through())
+    if deltas:
+        add_to_stats(deltas)
+        logger.info("📊 Applied stats deltas: %s", deltas)
+    return {'statusCode': 200}
@@ -2,64 +2,140 @@
 # For educational and portfolio use only.
 
 import boto3
-import csv
 import json
+import orjson
 import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import hashlib
 import os
+import time
 import urllib3
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
 import logging
-from decimal import Decimal
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from operator import itemgetter
+from urllib.parse import unquote
+from pdfminer.high_level import extract_text
 
 # === Logging ===
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # === AWS Clients ===
-s3 = boto3.client('s3')
-textract = boto3.client('textract')
-dynamodb = boto3.resource('dynamodb')
-secrets_manager = boto3.client('secretsmanager')
+# Shared config: larger keep-alive pool and SDK-level retries, so warm
+# invocations reuse TCP/TLS connections and transient errors don't fail the run.
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'standard', 'max_attempts': 3}
+)
+# Throttle-prone services use adaptive retries: client-side rate limiting
+# with jittered backoff instead of failing the whole invocation.
+ADAPTIVE_CONFIG = BOTO_CONFIG.merge(Config(retries={'mode': 'adaptive', 'max_attempts': 5}))
+s3 = boto3.client('s3', config=ADAPTIVE_CONFIG)
+textract = boto3.client('textract', config=ADAPTIVE_CONFIG)
+dynamodb = boto3.client('dynamodb', config=BOTO_CONFIG)
+secrets_manager = boto3.client('secretsmanager', config=BOTO_CONFIG)
+firehose = boto3.client('firehose', config=BOTO_CONFIG)
 
 # === BEDROCK CLIENT ===
-bedrock = boto3.client(service_name='bedrock-runtime', region_name='eu-central-1')
+bedrock = boto3.client(
+    service_name='bedrock-runtime', region_name='eu-central-1', config=ADAPTIVE_CONFIG
+)
+BEDROCK_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+
+# === PROMPT (built once at import, formatted to avoid E501 Line too long errors) ===
+EXTRACTION_PROMPT_TEMPLATE = """
+    You are a financial AI. Extract these fields from the invoice text below into JSON:
+    1. supplier_vat_id: The full VAT number (e.g., IT123456789 or CHE-123.456.789).
+    2. vat_rate: The tax percentage as a decimal (e.g. 0.22). If multiple, take the main one.
+    3. vat_amount: The tax amount (numeric).
+    4. net_total: The total amount BEFORE tax (numeric).
+    5. currency: Symbol (e.g., €, $, £, CHF).
+    6. country: The 2-letter ISO country code.
+    RULE: If VAT ID starts with "CHE", country MUST be "CH".
+    Return ONLY valid JSON. If a field is missing, use null.
+    TEXT:
+    {ocr_text}
+    """
+# Invoice header (supplier, VAT ID) sits at the start and totals at the end;
+# only those slices of long texts are sent to the model
+PROMPT_HEAD_CHARS = 2500
+PROMPT_TAIL_CHARS = 2500
+# Part of the AI cache key: changing the model or the prompt invalidates old extractions
+PROMPT_VERSION = hashlib.sha256(
+    f"{EXTRACTION_PROMPT_TEMPLATE}|{PROMPT_HEAD_CHARS}|{PROMPT_TAIL_CHARS}".encode('utf-8')
+).hexdigest()[:16]
 
 # === CONFIGURATION ===
 STATUS_TABLE_NAME = os.environ['STATUS_TABLE_NAME']
+AI_CACHE_TABLE_NAME = os.environ['AI_CACHE_TABLE_NAME']
 CONFIG_BUCKET = os.environ['CONFIG_BUCKET']
 CONFIG_FILE_KEY = os.environ['CONFIG_FILE_KEY']
 PARQUET_BUCKET = os.environ['PARQUET_BUCKET']
-PARQUET_PREFIX = os.environ['PARQUET_PREFIX']
+OCR_TEXT_PREFIX = os.environ['OCR_TEXT_PREFIX']
 SLACK_SECRET_NAME = os.environ['SLACK_SECRET_NAME']
-
-table = dynamodb.Table(STATUS_TABLE_NAME)
+TEXTRACT_SNS_TOPIC_ARN = os.environ['TEXTRACT_SNS_TOPIC_ARN']
+TEXTRACT_SNS_ROLE_ARN = os.environ['TEXTRACT_SNS_ROLE_ARN']
+FIREHOSE_STREAM_NAME = os.environ['FIREHOSE_STREAM_NAME']
 
 # === GLOBAL CACHE ===
+# Thread pool reused across warm invocations for independent network I/O
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
 CACHED_SLACK_WEBHOOK_URL = None
-HTTP_POOL = urllib3.PoolManager()
+# Single pool reused across warm invocations to keep the Slack TLS connection alive
+HTTP_POOL = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=4,
+    retries=urllib3.Retry(total=2, backoff_factor=0.1),
+    # Slack is best-effort: a slow webhook must not hold up the invocation
+    timeout=urllib3.Timeout(connect=0.5, read=1.0)
+)
+# (revision, rates): the S3 ETag of the config file and the rates parsed from it
 CACHED_ALLOWED_RATES = None
 
+# Non-ISO country codes the model may return (Swiss VAT IDs start with CHE)
+COUNTRY_ALIASES = {'CHE': 'CH'}
+
+# Embedded text shorter than this is treated as a scan and sent to Textract
+MIN_EMBEDDED_TEXT_CHARS = 100
+
+# Cached AI extractions expire after 30 days (DynamoDB TTL)
+AI_CACHE_TTL_SECONDS = 30 * 86400
+
+# Tolerance of 5 cents for rounding differences in the VAT math check
+VAT_TOLERANCE = Decimal("0.05")
+CENT = Decimal("0.01")
+
 # --- HELPER FUNCTIONS ---
 
 def load_allowed_rates():
     global CACHED_ALLOWED_RATES
-    if CACHED_ALLOWED_RATES:
-        return CACHED_ALLOWED_RATES
-
-    logger.info(f"Loading VAT rates from s3://{CONFIG_BUCKET}/{CONFIG_FILE_KEY}")
     try:
-        resp = s3.get_object(Bucket=CONFIG_BUCKET, Key=CONFIG_FILE_KEY)
-        lines = resp['Body'].read().decode('utf-8').splitlines()
-        reader = csv.DictReader(lines)
-        rates = {}
-        for row in reader:
-            country = row['country'].upper()
-            rate = float(row['rate'])
-            rates.setdefault(country, []).append(rate)
-
-        CACHED_ALLOWED_RATES = rates
+        # Conditional GET: warm containers get a bodyless 304 (one round trip)
+        # and only re-download the JSON when its ETag changes.
+        kwargs = {'Bucket': CONFIG_BUCKET, 'Key': CONFIG_FILE_KEY}
+        if CACHED_ALLOWED_RATES:
+            kwargs['IfNoneMatch'] = CACHED_ALLOWED_RATES[0]
+        try:
+            resp = s3.get_object(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] == '304':
+                return CACHED_ALLOWED_RATES[1]
+            raise
+
+        logger.info(f"Loaded VAT rates from s3://{CONFIG_BUCKET}/{CONFIG_FILE_KEY}")
+        # {"IT": [0.22, 0.1, 0.04], ...}: decoded in one orjson call
+        config = orjson.loads(resp['Body'].read())
+        # Integer basis points (0.22 -> 2200): exact, O(1) membership checks
+        rates = {
+            country.upper(): frozenset(int(round(rate * 10000)) for rate in country_rates)
+            for country, country_rates in config.items()
+        }
+
+        CACHED_ALLOWED_RATES = (resp['ETag'], rates)
         return rates
     except Exception as e:
         logger.error(f"Failed to load config file: {e}")
@@ -74,79 +150,237 @@ def get_slack_webhook():
         response = secrets_manager.get_secret_value(SecretId=SLACK_SECRET_NAME)
         secret_string = response['SecretString']
         try:
-            secret_data = json.loads(secret_string)
+            secret_data = orjson.loads(secret_string)
             CACHED_SLACK_WEBHOOK_URL = secret_data.get('webhook_url', secret_string)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             CACHED_SLACK_WEBHOOK_URL = secret_string
         return CACHED_SLACK_WEBHOOK_URL
     except Exception as e:
         logger.error(f"Error retrieving Slack secret: {e}")
         return None
 
+# Prefetch the secret after each SnapStart restore rather than at init, so
+# it is never captured in the snapshot. The hook module only exists in the
+# Lambda runtime.
+try:
+    from snapshot_restore_py import register_after_restore
+
+    @register_after_restore
+    def prefetch_slack_webhook():
+        EXECUTOR.submit(get_slack_webhook)
+except ImportError:
+    pass
+
 def send_slack_notification(msg):
     try:
         hook = get_slack_webhook()
         if hook:
             HTTP_POOL.request(
                 "POST", hook,
-                body=json.dumps({"text": msg}).encode(),
+                body=orjson.dumps({"text": msg}),
                 headers={"Content-Type": "application/json"}
             )
     except Exception as e:
         logger.error(f"Error sending Slack notification: {e}")
 
-def save_parquet_to_s3(data: dict, key: str):
+def to_attribute_values(item: dict) -> dict:
+    """
+    Marshals a result item straight into DynamoDB's low-level format,
+    specialized to the fixed result schema. None values are dropped.
+    """
+    # The AI can return any JSON type for the text fields (e.g. a numeric VAT ID)
+    attrs = {
+        'invoice_id': {'S': str(item['invoice_id'])},
+        'country': {'S': str(item['country'])},
+        'currency': {'S': str(item['currency'])},
+        'supplier_vat_id': {'S': str(item['supplier_vat_id'])},
+        'status': {'S': str(item['status'])},
+        'reason': {'S': str(item['reason'])},
+        'ts_ms': {'N': str(item['ts_ms'])},
+    }
+    if item['ocr_uri'] is not None:
+        attrs['ocr_uri'] = {'S': item['ocr_uri']}
+    # The AI fields are numbers unless the model returned something else
+    for name in ('vat_rate', 'vat_amount', 'net_total'):
+        value = item[name]
+        if value is None:
+            continue
+        if isinstance(value, (Decimal, int)) and not isinstance(value, bool):
+            attrs[name] = {'N': str(value)}
+        else:
+            attrs[name] = {'S': str(value)}
+    return attrs
+
+def write_status_items(results):
+    """Writes result items with BatchWriteItem (25 per request), retrying unprocessed ones."""
+    requests = [{'PutRequest': {'Item': to_attribute_values(r)}} for r in results]
+    for i in range(0, len(requests), 25):
+        pending = {STATUS_TABLE_NAME: requests[i:i + 25]}
+        for attempt in range(5):
+            pending = dynamodb.batch_write_item(RequestItems=pending).get('UnprocessedItems')
+            if not pending:
+                break
+            time.sleep(0.1 * 2 ** attempt)
+        else:
+            raise RuntimeError("DynamoDB left items unprocessed after retries")
+
+def send_to_analytics(results):
+    """
+    Streams result rows to Firehose, which buffers them and writes large
+    Parquet files (schema from the Glue table) instead of one file per invoice.
+    Rows are appended, never overwritten: retries and re-uploads add rows, and
+    the invoices_latest Athena view keeps the newest one per invoice.
+    """
+    records = [
+        {'Data': orjson.dumps(r, default=float, option=orjson.OPT_APPEND_NEWLINE)}
+        for r in results
+    ]
+    try:
+        for attempt in range(3):
+            resp = firehose.put_record_batch(
+                DeliveryStreamName=FIREHOSE_STREAM_NAME, Records=records
+            )
+            if not resp['FailedPutCount']:
+                return
+            # Only resend the records Firehose rejected
+            records = [
+                rec for rec, res in zip(records, resp['RequestResponses'])
+                if 'ErrorCode' in res
+            ]
+            time.sleep(0.1 * 2 ** attempt)
+        logger.error(f"Firehose rejected {len(records)} analytics records after retries")
+    except Exception as e:
+        logger.error(f"Failed to send analytics records: {e}")
+
+def to_decimal(value):
+    """Returns the AI value as a Decimal (numbers are already parsed as Decimal)."""
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+def to_basis_points(rate):
+    """Converts a decimal VAT rate (e.g. 0.22) to integer basis points (2200), None if invalid."""
     try:
-        df = pd.DataFrame([data])
-        tbl = pa.Table.from_pandas(df)
-        tmp_path = f"/tmp/{key}.parquet"
-        pq.write_table(tbl, tmp_path)
-
-        output_key = f"{PARQUET_PREFIX}{key}.parquet"
-        with open(tmp_path, 'rb') as f:
-            s3.upload_fileobj(f, PARQUET_BUCKET, output_key)
-        os.remove(tmp_path)
+        return int((to_decimal(rate) * 10000).to_integral_value(rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return None
+
+def compute_expected_vat(net_total, vat_rate):
+    """Net total times rate, rounded half-up to the cent like an invoice."""
+    return (to_decimal(net_total) * to_decimal(vat_rate)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def vat_amount_matches(expected_vat, vat_amount):
+    """True if the stated VAT amount is within VAT_TOLERANCE of the expected one."""
+    return abs(expected_vat - to_decimal(vat_amount)) <= VAT_TOLERANCE
+
+def normalize_country(country):
+    """Maps the AI's country output to the upper-case 2-letter codes used in the config."""
+    if not country:
+        return country
+    code = country.strip().upper()
+    return COUNTRY_ALIASES.get(code, code)
+
+def extract_embedded_text(pdf_bytes):
+    """
+    Reads the text layer of the PDF (added or preserved by the preprocess
+    Lambda). Returns an empty string if the file has no usable text layer.
+    """
+    try:
+        return extract_text(BytesIO(pdf_bytes))
     except Exception as e:
-        logger.error(f"Failed to save Parquet: {e}")
+        logger.warning(f"Embedded text extraction failed: {e}")
+        return ""
 
-def is_valid_pdf(bucket, key):
+def read_pdf(bucket, key):
+    """
+    Downloads the file once and checks the %PDF magic number on the bytes in
+    hand. Returns (bytes, user metadata), or None if the file can't be read
+    or isn't a PDF.
+    """
     try:
-        # read 4 byte (Range request)
-        response = s3.get_object(
-            Bucket=bucket,
-            Key=key,
-            Range='bytes=0-4'
+        resp = s3.get_object(Bucket=bucket, Key=key)
+        pdf_bytes = resp['Body'].read()
+    except Exception as e:
+        logger.error(f"Error reading file: {e}")
+        return None
+    return (pdf_bytes, resp['Metadata']) if pdf_bytes.startswith(b'%PDF') else None
+
+def invoice_id_from_key(key):
+    return os.path.basename(key).replace('.pdf', '')
+
+def resolve_invoice_id(metadata, key):
+    """
+    Prefers the business ID set by the uploader ('invoice-id' metadata,
+    URL-quoted because S3 metadata is ASCII). Falls back to the file name.
+    """
+    if 'invoice-id' in metadata:
+        return unquote(metadata['invoice-id'])
+    return invoice_id_from_key(key)
+
+GET_TEXT = itemgetter('Text')
+
+def is_line_block(block):
+    return block['BlockType'] == 'LINE'
+
+def lines_to_text(blocks):
+    """Joins the LINE blocks of a Textract response into plain text."""
+    # filter/map/itemgetter keep the per-block loop in C
+    return '\n'.join(map(GET_TEXT, filter(is_line_block, blocks)))
+
+def start_textract_job(bucket, key):
+    """
+    Starts asynchronous OCR for a scanned PDF. Textract publishes to the SNS
+    topic when done, which triggers textract_result_handler.
+    """
+    resp = textract.start_document_text_detection(
+        DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}},
+        NotificationChannel={
+            'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN,
+            'RoleArn': TEXTRACT_SNS_ROLE_ARN
+        }
+    )
+    return resp['JobId']
+
+def get_textract_job_text(job_id):
+    """Collects the text of a finished Textract job, following pagination."""
+    blocks = []
+    kwargs = {'JobId': job_id}
+    while True:
+        resp = textract.get_document_text_detection(**kwargs)
+        blocks.extend(resp['Blocks'])
+        if 'NextToken' not in resp:
+            return lines_to_text(blocks)
+        kwargs['NextToken'] = resp['NextToken']
+
+def save_ocr_text(invoice_id, full_text):
+    """
+    Stores the full OCR text in the data bucket and returns its s3:// URI.
+    Only the URI goes into DynamoDB, keeping items (and the stream) small.
+    """
+    key = f"{OCR_TEXT_PREFIX}{invoice_id}.txt"
+    try:
+        s3.put_object(
+            Bucket=PARQUET_BUCKET, Key=key,
+            Body=full_text.encode('utf-8'), ContentType='text/plain; charset=utf-8'
         )
-        header = response['Body'].read()
-        if header.startswith(b'%PDF'):
-            return True
-        return False
+        return f"s3://{PARQUET_BUCKET}/{key}"
     except Exception as e:
-        logger.error(f"Error checking file header: {e}")
-        return False
+        logger.error(f"Failed to save OCR text: {e}")
+        return None
 
 # --- AI EXTRACTION ENGINE (Claude 3 Haiku) ---
 
+def trim_for_prompt(ocr_text):
+    """Keeps the head and tail of long invoice texts to cut input tokens."""
+    if len(ocr_text) <= PROMPT_HEAD_CHARS + PROMPT_TAIL_CHARS:
+        return ocr_text
+    return ocr_text[:PROMPT_HEAD_CHARS] + "\n...\n" + ocr_text[-PROMPT_TAIL_CHARS:]
+
 def extract_invoice_data_with_ai(ocr_text):
     """
     Uses AWS Bedrock to extract structured data from OCR text.
     Replaces fragile Regex logic with semantic understanding.
     """
-    # === PROMPT (Formatted to avoid E501 Line too long errors) ===
-    prompt = f"""
-    You are a financial AI. Extract these fields from the invoice text below into JSON:
-    1. supplier_vat_id: The full VAT number (e.g., IT123456789 or CHE-123.456.789).
-    2. vat_rate: The tax percentage as a decimal (e.g. 0.22). If multiple, take the main one.
-    3. vat_amount: The tax amount (numeric).
-    4. net_total: The total amount BEFORE tax (numeric).
-    5. currency: Symbol (e.g., €, $, £, CHF).
-    6. country: The 2-letter ISO country code.
-    RULE: If VAT ID starts with "CHE", country MUST be "CH".
-    Return ONLY valid JSON. If a field is missing, use null.
-    TEXT:
-    {ocr_text[:15000]}
-    """
-    body = json.dumps({
+    prompt = EXTRACTION_PROMPT_TEMPLATE.format(ocr_text=trim_for_prompt(ocr_text))
+    body = orjson.dumps({
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 1000,
         "messages": [{"role": "user", "content": prompt}],
@@ -155,59 +389,105 @@ def extract_invoice_data_with_ai(ocr_text):
 
     try:
         response = bedrock.invoke_model(
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
+            modelId=BEDROCK_MODEL_ID,
             body=body
         )
 
-        response_body = json.loads(response.get("body").read())
+        response_body = orjson.loads(response.get("body").read())
         ai_result = response_body["content"][0]["text"]
 
         # Clean up markdown
         ai_result = ai_result.replace("```json", "").replace("```", "").strip()
 
-        return json.loads(ai_result)
+        # Decimal numbers: exact VAT math and direct DynamoDB 'N' values
+        # (stdlib json here: orjson has no parse_float hook)
+        return json.loads(ai_result, parse_float=Decimal)
 
     except Exception as e:
         logger.error(f"AI Extraction Failed: {e}")
         return None
 
-# --- MAIN HANDLER ---
+def extract_invoice_data_cached(ocr_text):
+    """
+    Looks up the AI extraction for this exact text, model and prompt before
+    calling Bedrock, so duplicate or re-uploaded invoices skip the model.
+    Cache errors are not fatal.
+    """
+    cache_input = f"{BEDROCK_MODEL_ID}|{PROMPT_VERSION}|{ocr_text}"
+    text_hash = hashlib.sha256(cache_input.encode('utf-8')).hexdigest()
+    try:
+        cached = dynamodb.get_item(
+            TableName=AI_CACHE_TABLE_NAME, Key={'text_hash': {'S': text_hash}}
+        ).get('Item')
+        if cached:
+            logger.info("AI cache hit, skipping Bedrock.")
+            return json.loads(cached['ai_json']['S'], parse_float=Decimal)
+    except Exception as e:
+        logger.warning(f"AI cache lookup failed: {e}")
 
-def lambda_handler(event, context):
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
-    invoice_id = os.path.basename(key).replace('.pdf', '')
+    extracted = extract_invoice_data_with_ai(ocr_text)
+    if extracted is not None:
+        try:
+            dynamodb.put_item(TableName=AI_CACHE_TABLE_NAME, Item={
+                'text_hash': {'S': text_hash},
+                'ai_json': {'S': orjson.dumps(extracted, default=float).decode()},
+                'ttl': {'N': str(int(time.time()) + AI_CACHE_TTL_SECONDS)},
+            })
+        except Exception as e:
+            logger.warning(f"AI cache write failed: {e}")
+    return extracted
+
+# --- VALIDATION PIPELINE ---
+
+def process_record(record):
+    """
+    Handles one S3 record. Files with a text layer are validated right away
+    and their result item is returned; scanned files are handed to async
+    Textract and None is returned (as for skipped files).
+    """
+    bucket = record['s3']['bucket']['name']
+    key = record['s3']['object']['key']
 
     # === SECURITY CHECK: Demo Mode Limit ===
     # If file > 2MB, block it to prevent cost abuse
-    if event['Records'][0]['s3']['object']['size'] > 2 * 1024 * 1024:
+    if record['s3']['object']['size'] > 2 * 1024 * 1024:
         logger.warning(f"File {key} too large (>2MB). Skipping for Demo Mode.")
-        return {'statusCode': 400, 'body': 'File too large'}
+        return None
 
     # If file is not a PDF, stop processing
-    if not is_valid_pdf(bucket, key):
+    pdf = read_pdf(bucket, key)
+    if pdf is None:
         logger.warning(f"File {key} is NOT a valid PDF. Skipping.")
         # s3.delete_object(Bucket=bucket, Key=key)
-        return {'statusCode': 400, 'body': 'Invalid file type'}
+        return None
+    pdf_bytes, metadata = pdf
+    invoice_id = resolve_invoice_id(metadata, key)
 
     logger.info(f"Processing {invoice_id} from s3://{bucket}/{key}")
 
-    # 1. Textract (OCR Only)
-    try:
-        # DetectDocumentText because we only need raw text for the LLM
-        resp = textract.detect_document_text(
-            Document={'S3Object': {'Bucket': bucket, 'Name': key}}
-        )
-        lines = [b['Text'] for b in resp['Blocks'] if b['BlockType'] == 'LINE']
-        full_text = '\n'.join(lines)
-        logger.info("Text extraction complete.")
-    except Exception as e:
-        logger.error(f"Textract failed: {e}")
-        raise e
+    # 1. Text extraction: embedded text layer first, async Textract (OCR) as fallback
+    full_text = extract_embedded_text(pdf_bytes)
+    if len(full_text.strip()) < MIN_EMBEDDED_TEXT_CHARS:
+        try:
+            job_id = start_textract_job(bucket, key)
+            logger.info(f"No text layer, started Textract job {job_id}.")
+            return None
+        except Exception as e:
+            logger.error(f"Textract failed: {e}")
+            raise e
+
+    logger.info("Using embedded PDF text layer, skipping Textract.")
+    return build_result(invoice_id, full_text)
+
+def build_result(invoice_id, full_text):
+    """Runs AI extraction and deterministic validation on the invoice text."""
+    # The config check (conditional GET) and the OCR text upload run while Bedrock is working
+    rates_future = EXECUTOR.submit(load_allowed_rates)
+    ocr_uri_future = EXECUTOR.submit(save_ocr_text, invoice_id, full_text)
 
     # 2. AI Extraction (Bedrock)
     logger.info("🤖 Invoking Bedrock AI...")
-    extracted = extract_invoice_data_with_ai(full_text)
+    extracted = extract_invoice_data_cached(full_text)
 
     # Variables initialization
     country = None
@@ -221,9 +501,7 @@ def lambda_handler(event, context):
 
     if extracted:
         logger.info(f"✅ AI Data: {extracted}")
-        country = extracted.get("country")
-        if country and country.upper() == 'CHE':
-            country = 'CH'
+        country = normalize_country(extracted.get("country"))
         vat_rate = extracted.get("vat_rate")
         vat_amount = extracted.get("vat_amount")
         net_total = extracted.get("net_total")
@@ -235,7 +513,7 @@ def lambda_handler(event, context):
         reasons.append("AI Extraction Failed")
 
     # 3. Validation Logic (Deterministic)
-    allowed_rates = load_allowed_rates()
+    allowed_rates = rates_future.result()
 
     if status != "FAIL": # Only validate if AI succeeded
         if not vid:
@@ -247,21 +525,21 @@ def lambda_handler(event, context):
         elif country not in allowed_rates:
             reasons.append(f"Country code '{country}' not in configuration")
             status = "FAIL"
-        elif vat_rate not in allowed_rates.get(country, []):
+        elif to_basis_points(vat_rate) not in allowed_rates[country]:
             reasons.append(f"Invalid VAT rate {vat_rate} for country {country}")
             status = "FAIL"
 
-        # Mathematical Check
+        # Mathematical Check (Decimal, no float rounding drift)
         if status == "PASS" and net_total:
-            expected_vat = round(net_total * vat_rate, 2)
-            # Tolerance 0.05 for rounding differences
-            if abs(expected_vat - vat_amount) > 0.05:
+            expected_vat = compute_expected_vat(net_total, vat_rate)
+            if not vat_amount_matches(expected_vat, vat_amount):
                 reasons.append(f"Math check failed: expected {expected_vat}, got {vat_amount}")
                 status = "FAIL"
 
     logger.info(f"Validation: {status}. Reason: {reasons}")
 
-    # 4. Store Results
+    # 4. Build Result
+    ts_ms = time.time_ns() // 1_000_000
     result_item = {
         'invoice_id': invoice_id,
         'country': country or "N/A",
@@ -272,30 +550,99 @@ def lambda_handler(event, context):
         'supplier_vat_id': vid or "N/A",
         'status': status,
         'reason': "; ".join(reasons) or "Passed",
-        'ocr_text': full_text[:3000], # Truncate for DynamoDB limits
-        'timestamp': datetime.datetime.utcnow().isoformat(),
-    }
-
-    # DynamoDB Decimal conversion
-    dynamo_item = {
-        k: (Decimal(str(v)) if isinstance(v, (float, int)) else v)
-        for k, v in result_item.items() if v is not None
+        'ocr_uri': ocr_uri_future.result(),
+        'ts_ms': ts_ms,  # epoch millis: compact, numerically sortable key in DynamoDB
+        # Human-readable copy for the analytics rows only (not written to DynamoDB)
+        'timestamp': datetime.datetime.fromtimestamp(ts_ms / 1000, datetime.UTC).isoformat(),
     }
 
-    try:
-        # Save to DynamoDB
-        table.put_item(Item=dynamo_item)
+    return result_item
 
-        # Save to S3 (Parquet)
-        save_parquet_to_s3(result_item, invoice_id)
+def failed_result(invoice_id, reason):
+    """Result item for an invoice that never reached AI extraction."""
+    ts_ms = time.time_ns() // 1_000_000
+    return {
+        'invoice_id': invoice_id,
+        'country': "N/A",
+        'vat_rate': None,
+        'vat_amount': None,
+        'net_total': None,
+        'currency': "N/A",
+        'supplier_vat_id': "N/A",
+        'status': "FAIL",
+        'reason': reason,
+        'ocr_uri': None,
+        'ts_ms': ts_ms,
+        'timestamp': datetime.datetime.fromtimestamp(ts_ms / 1000, datetime.UTC).isoformat(),
+    }
 
-        # Notify Slack
-        send_slack_notification(
-            f"Invoice {invoice_id} | {country} | {status} | {result_item['reason']}"
-        )
+def store_results(results):
+    """
+    Writes all results to DynamoDB, then streams them to Firehose and posts
+    one Slack summary. The DynamoDB write goes first, as it's the source of
+    truth: if it fails, the retried invocation doesn't duplicate the rows and
+    posts. The two follow-ups are independent, so they run concurrently.
+    """
+    summary = "\n".join(
+        f"Invoice {r['invoice_id']} | {r['country']} | {r['status']} | {r['reason']}"
+        for r in results
+    )
 
+    try:
+        # Save to DynamoDB (batched, pre-marshalled items)
+        write_status_items(results)
+
+        futures = [
+            # Analytics (Firehose -> batched Parquet on S3)
+            EXECUTOR.submit(send_to_analytics, results),
+            # Notify Slack
+            EXECUTOR.submit(send_slack_notification, summary),
+        ]
+        for future in as_completed(futures):
+            future.result()
     except Exception as e:
         logger.error(f"Storage failed: {e}")
         raise
 
+# --- MAIN HANDLERS ---
+
+def lambda_handler(event, context):
+    # S3 notifications may carry several records; process all of them
+    results = []
+    for record in event['Records']:
+        result_item = process_record(record)
+        if result_item:
+            results.append(result_item)
+
+    if results:
+        store_results(results)
+
+    return {'statusCode': 200, 'body': json.dumps('Validation complete')}
+
+def textract_result_handler(event, context):
+    """Resumes the pipeline when Textract reports a finished OCR job via SNS."""
+    results = []
+    for record in event['Records']:
+        message = orjson.loads(record['Sns']['Message'])
+        job_id = message['JobId']
+        key = message['DocumentLocation']['S3ObjectName']
+
+        metadata = s3.head_object(
+            Bucket=message['DocumentLocation']['S3Bucket'], Key=key
+        )['Metadata']
+        invoice_id = resolve_invoice_id(metadata, key)
+
+        # A failed job still gets a status item, so it alerts and shows on the dashboard
+        if message['Status'] != 'SUCCEEDED':
+            logger.error(f"Textract job {job_id} for {key} ended with {message['Status']}")
+            results.append(failed_result(invoice_id, f"OCR failed ({message['Status']})"))
+            continue
+
+        full_text = get_textract_job_text(job_id)
+        logger.info(f"Text extraction complete for job {job_id}.")
+        results.append(build_result(invoice_id, full_text))
+
+    if results:
+        store_results(results)
+
     return {'statusCode': 200, 'body': json.dumps('Validation complete')}
@@ -1,6 +1,10 @@
 import os
+from itertools import islice
 
 def test_bad_invoice_exists():
-    files = os.listdir("tests/assets")
-    bad_pdfs = [f for f in files if f.lower().endswith(".pdf")]
+    # Stop scanning as soon as two PDFs are found
+    with os.scandir("tests/assets") as entries:
+        bad_pdfs = list(islice(
+            (e for e in entries if e.is_file() and e.name.lower().endswith(".pdf")), 2
+        ))
     assert len(bad_pdfs) >= 2, "🚨 Add at least 2 bad invoice PDFs to tests/assets/"
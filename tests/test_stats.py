@@ -0,0 +1,136 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+LAMBDA_PATH = ROOT / "src" / "vcm-stats-lambda" / "lambda_function.py"
+
+ENV = {"STATUS_TABLE_NAME": "status-table", "STATS_TABLE_NAME": "stats-table"}
+
+
+class ClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        super().__init__(operation_name)
+        self.response = error_response
+
+
+def conditional_check_failed():
+    return ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    """Imports the stats Lambda with its env vars set and a stubbed DynamoDB client."""
+    exceptions = types.ModuleType("botocore.exceptions")
+    exceptions.ClientError = ClientError
+    for name, value in ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setitem(sys.modules, "boto3", MagicMock())
+    monkeypatch.setitem(sys.modules, "botocore", MagicMock())
+    monkeypatch.setitem(sys.modules, "botocore.config", MagicMock())
+    monkeypatch.setitem(sys.modules, "botocore.exceptions", exceptions)
+    spec = importlib.util.spec_from_file_location("vcm_stats_lambda", LAMBDA_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.dynamodb = MagicMock()
+    return module
+
+
+def image(status, country="IT", ts_ms=2000):
+    return {
+        "invoice_id": {"S": "INV-1"},
+        "status": {"S": status},
+        "country": {"S": country},
+        "ts_ms": {"N": str(ts_ms)},
+    }
+
+
+def record(new=None, old=None):
+    images = {}
+    if new:
+        images["NewImage"] = new
+    if old:
+        images["OldImage"] = old
+    return {"dynamodb": images}
+
+
+def test_insert_counts_once(stats):
+    deltas = stats.batch_deltas([record(new=image("PASS"))], seeded_through=0)
+    assert deltas == {"total": 1, "pass_count": 1, "country_IT": 1}
+
+
+def test_identical_overwrite_is_idempotent(stats):
+    deltas = stats.batch_deltas(
+        [record(new=image("FAIL", ts_ms=3000), old=image("FAIL"))], seeded_through=0
+    )
+    assert deltas == {}
+
+
+def test_modify_moves_status_and_country(stats):
+    deltas = stats.batch_deltas(
+        [record(new=image("FAIL", "DE", ts_ms=3000), old=image("PASS", "IT"))],
+        seeded_through=0,
+    )
+    assert deltas == {"pass_count": -1, "country_IT": -1, "country_DE": 1}
+
+
+def test_remove_subtracts(stats):
+    deltas = stats.batch_deltas([record(old=image("PASS"))], seeded_through=0)
+    assert deltas == {"total": -1, "pass_count": -1, "country_IT": -1}
+
+
+def test_records_covered_by_seed_are_skipped(stats):
+    records = [
+        record(new=image("PASS", ts_ms=2000)),
+        record(new=image("FAIL", "FR", ts_ms=2001)),
+    ]
+    assert stats.batch_deltas(records, seeded_through=2000) == {"total": 1, "country_FR": 1}
+
+
+def test_add_to_stats_is_one_atomic_add(stats):
+    stats.add_to_stats({"total": 2, "country_IT": -1})
+    kwargs = stats.dynamodb.update_item.call_args.kwargs
+    assert kwargs["TableName"] == "stats-table"
+    assert kwargs["UpdateExpression"] == "ADD #a0 :a0, #a1 :a1"
+    assert kwargs["ExpressionAttributeNames"] == {"#a0": "total", "#a1": "country_IT"}
+    assert kwargs["ExpressionAttributeValues"] == {":a0": {"N": "2"}, ":a1": {"N": "-1"}}
+
+
+def test_first_batch_seeds_from_scan(stats):
+    stats.dynamodb.get_item.side_effect = [
+        {},
+        {"Item": {"seeded_through_ts_ms": {"N": "2000"}}},
+    ]
+    stats.dynamodb.scan.side_effect = [
+        {"Items": [image("PASS", ts_ms=1000)], "LastEvaluatedKey": {"invoice_id": {"S": "a"}}},
+        {"Items": [image("FAIL", "DE", ts_ms=2000)]},
+    ]
+    # Both results are in the scan: the batch that triggered the seed adds nothing
+    stats.lambda_handler({"Records": [record(new=image("FAIL", "DE", ts_ms=2000))]}, None)
+
+    item = stats.dynamodb.put_item.call_args.kwargs["Item"]
+    assert item["total"] == {"N": "2"}
+    assert item["pass_count"] == {"N": "1"}
+    assert item["country_IT"] == {"N": "1"} and item["country_DE"] == {"N": "1"}
+    assert item["seeded_through_ts_ms"] == {"N": "2000"}
+    stats.dynamodb.update_item.assert_not_called()
+    assert stats.get_seeded_through() == 2000
+
+
+def test_lost_seed_race_reads_the_winner(stats):
+    stats.dynamodb.get_item.side_effect = [
+        {},
+        {"Item": {"seeded_through_ts_ms": {"N": "1500"}}},
+    ]
+    stats.dynamodb.scan.return_value = {"Items": []}
+    stats.dynamodb.put_item.side_effect = conditional_check_failed()
+
+    stats.lambda_handler({"Records": [record(new=image("PASS", ts_ms=2000))]}, None)
+
+    assert stats.dynamodb.update_item.call_args.kwargs["ExpressionAttributeValues"] == {
+        ":a0": {"N": "1"}, ":a1": {"N": "1"}, ":a2": {"N": "1"}
+    }
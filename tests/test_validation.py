@@ -0,0 +1,142 @@
+import importlib.util
+import sys
+import types
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+APP_PATH = ROOT / "src" / "vcm-textract-lambda" / "app.py"
+
+ENV = {
+    "STATUS_TABLE_NAME": "status-table",
+    "AI_CACHE_TABLE_NAME": "ai-cache-table",
+    "CONFIG_BUCKET": "config-bucket",
+    "CONFIG_FILE_KEY": "config/allowed-vat-rates.json",
+    "PARQUET_BUCKET": "config-bucket",
+    "OCR_TEXT_PREFIX": "ocr-text/",
+    "SLACK_SECRET_NAME": "slack-secret",
+    "TEXTRACT_SNS_TOPIC_ARN": "arn:aws:sns:eu-central-1:123456789012:textract",
+    "TEXTRACT_SNS_ROLE_ARN": "arn:aws:iam::123456789012:role/textract",
+    "FIREHOSE_STREAM_NAME": "invoice-results",
+}
+
+
+class ClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        super().__init__(operation_name)
+        self.response = error_response
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Imports the validation Lambda with its env vars set and AWS/PDF clients stubbed."""
+    exceptions = types.ModuleType("botocore.exceptions")
+    exceptions.ClientError = ClientError
+    stubs = {
+        "boto3": MagicMock(),
+        "botocore": MagicMock(),
+        "botocore.config": MagicMock(),
+        "botocore.exceptions": exceptions,
+        "urllib3": MagicMock(),
+        "pdfminer": MagicMock(),
+        "pdfminer.high_level": MagicMock(),
+    }
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in ENV.items():
+            mp.setenv(name, value)
+        for name, module in stubs.items():
+            mp.setitem(sys.modules, name, module)
+        spec = importlib.util.spec_from_file_location("vcm_textract_app", APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+        module.EXECUTOR.shutdown(wait=False)
+
+
+@pytest.fixture
+def allowed_rates(app, monkeypatch):
+    """Rates parsed by load_allowed_rates from the shipped config file."""
+    body = (ROOT / "config" / "allowed-vat-rates.json").read_bytes()
+    s3 = MagicMock()
+    s3.get_object.return_value = {"Body": MagicMock(read=lambda: body), "ETag": '"etag"'}
+    monkeypatch.setattr(app, "s3", s3)
+    monkeypatch.setattr(app, "CACHED_ALLOWED_RATES", None)
+    return app.load_allowed_rates()
+
+
+def test_basis_points_match_config(app, allowed_rates):
+    assert app.to_basis_points(Decimal("0.22")) == 2200
+    assert app.to_basis_points(Decimal("0.22")) in allowed_rates["IT"]
+    assert app.to_basis_points(Decimal("0.055")) in allowed_rates["FR"]
+
+
+def test_basis_points_reject_percent_strings(app):
+    assert app.to_basis_points("22%") is None
+
+
+def test_normalize_country(app):
+    assert app.normalize_country("it") == "IT"
+    assert app.normalize_country(" CHE ") == "CH"
+    assert app.normalize_country(None) is None
+
+
+def test_vat_math_tolerance_boundary(app):
+    expected = app.compute_expected_vat(Decimal("100.00"), Decimal("0.22"))
+    assert expected == Decimal("22.00")
+    assert app.vat_amount_matches(expected, Decimal("22.05"))
+    assert app.vat_amount_matches(expected, Decimal("21.95"))
+    assert not app.vat_amount_matches(expected, Decimal("22.06"))
+    assert not app.vat_amount_matches(expected, Decimal("21.94"))
+
+
+def make_result(**overrides):
+    result = {
+        "invoice_id": "INV-1",
+        "country": "IT",
+        "vat_rate": Decimal("0.22"),
+        "vat_amount": Decimal("22.00"),
+        "net_total": Decimal("100.00"),
+        "currency": "€",
+        "supplier_vat_id": "IT123456789",
+        "status": "PASS",
+        "reason": "Passed",
+        "ocr_uri": None,
+        "ts_ms": 1700000000000,
+    }
+    result.update(overrides)
+    return result
+
+
+def test_attribute_values_decimal(app):
+    attrs = app.to_attribute_values(make_result())
+    assert attrs["vat_rate"] == {"N": "0.22"}
+    assert attrs["net_total"] == {"N": "100.00"}
+    assert attrs["ts_ms"] == {"N": "1700000000000"}
+    assert "ocr_uri" not in attrs
+
+
+def test_attribute_values_str_and_odd_types(app):
+    attrs = app.to_attribute_values(
+        make_result(vat_rate="22%", vat_amount=True, supplier_vat_id=123456789)
+    )
+    assert attrs["vat_rate"] == {"S": "22%"}
+    assert attrs["vat_amount"] == {"S": "True"}
+    assert attrs["supplier_vat_id"] == {"S": "123456789"}
+
+
+def test_attribute_values_drop_none(app):
+    attrs = app.to_attribute_values(
+        make_result(vat_rate=None, vat_amount=None, net_total=None, ocr_uri="s3://b/k.txt")
+    )
+    assert not {"vat_rate", "vat_amount", "net_total"} & attrs.keys()
+    assert attrs["ocr_uri"] == {"S": "s3://b/k.txt"}
+
+
+def test_failed_ocr_result_marshals(app):
+    attrs = app.to_attribute_values(app.failed_result("INV-9", "OCR failed (FAILED)"))
+    assert attrs["status"] == {"S": "FAIL"}
+    assert attrs["reason"] == {"S": "OCR failed (FAILED)"}
+    assert not {"vat_rate", "vat_amount", "net_total", "ocr_uri"} & attrs.keys()